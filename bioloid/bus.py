@@ -6,7 +6,7 @@
 import pyb
 
 from bioloid import packet
-from bioloid.packet import Packet
+from bioloid.packet import Packet, find_header, sum_bytes
 from bioloid.dump_mem import dump_mem
 from bioloid.log import log
 
@@ -33,9 +33,32 @@ class Bus:
     SHOW_COMMANDS   = (1 << 0)
     SHOW_PACKETS    = (1 << 1)
 
+    READ_CACHE_SIZE = 64    # Max number of cached READ packets
+
     def __init__(self, serial_port, show=SHOW_NONE):
         self.serial_port = serial_port
         self.show = show
+        # Ports which support read_exact (and deadline) allow the header and
+        # remainder of a status packet to each be read at once.
+        self._read_exact = getattr(serial_port, 'read_exact', None)
+        # Ports which support scatter writes allow packets to be written
+        # in pieces, which avoids copying the caller's data.
+        self._scatter_write = getattr(serial_port, 'supports_scatter_write', False)
+        self._tx_hdr = bytearray((0xff, 0xff, 0, 0, 0, 0))
+        self._tx_chk = bytearray(1)
+        # Outgoing packets are built in this buffer, which is reused to
+        # avoid allocating a new bytearray for every packet.
+        self._tx_buf = bytearray(256)
+        self._tx_mv = memoryview(self._tx_buf)
+        # Received bytes are saved in this buffer so that they can be
+        # logged. It grows if a status packet doesn't fit.
+        self._rx_buf = bytearray(32)
+        # Packets which only depend on their arguments are built once and
+        # then reused.
+        self._ping_pkts = {}
+        self._read_pkts = {}
+        self._action_pkt = self.make_packet(packet.Id.BROADCAST, packet.Command.ACTION)
+        self._reset_pkt = self.make_packet(packet.Id.BROADCAST, packet.Command.RESET)
 
     def action(self):
         """Broadcasts an action packet to all of the devices on the bus.
@@ -45,16 +68,18 @@ class Bus:
         """
         if self.show & Bus.SHOW_COMMANDS:
             log('Broadcasting ACTION')
-        self.fill_and_write_packet(packet.Id.BROADCAST, packet.Command.ACTION)
+        self.write_packet(self._action_pkt)
 
-    def fill_and_write_packet(self, dev_id, cmd, data=None):
-        """Allocates and fills a packet. data should be a bytearray of data
-           to include in the packet, or None if no data should be included.
+    def fill_packet(self, pkt_bytes, dev_id, cmd, data=None):
+        """Fills in a packet at the start of pkt_bytes. data should be a
+           bytearray of data to include in the packet, or None if no data
+           should be included.
+
+           Returns the length of the packet.
         """
         packet_len = 6
         if data is not None:
             packet_len += len(data)
-        pkt_bytes = bytearray(packet_len)
         pkt_bytes[0] = 0xff
         pkt_bytes[1] = 0xff
         pkt_bytes[2] = dev_id
@@ -63,7 +88,96 @@ class Bus:
         if data is not None:
             pkt_bytes[3] += len(data)
             pkt_bytes[5:packet_len - 1] = data
-        pkt_bytes[-1] = ~sum(pkt_bytes[2:-1]) & 0xff
+        # Accumulate the checksum from the header fields, and only sum the
+        # data in the buffer. Since the sum is never negative,
+        # ~sum & 0xff == 0xff ^ (sum & 0xff), and the latter avoids creating
+        # a negative intermediate.
+        checksum = dev_id + pkt_bytes[3] + cmd
+        if data is not None:
+            checksum += sum_bytes(pkt_bytes, 5, packet_len - 1)
+        pkt_bytes[packet_len - 1] = 0xff ^ (checksum & 0xff)
+        return packet_len
+
+    def fill_and_write_packet(self, dev_id, cmd, data=None):
+        """Fills a packet in the TX buffer and writes it. data should be
+           a bytearray of data to include in the packet, or None if no data
+           should be included.
+        """
+        if data is None:
+            self._write_short(dev_id, cmd)
+            return
+        packet_len = 6 + len(data)
+        self.fill_packet(self.tx_buffer(packet_len), dev_id, cmd, data)
+        self.write_tx_buffer(packet_len)
+
+    def _write_short(self, dev_id, cmd):
+        """Writes a packet with no data, which is always 6 bytes long."""
+        pkt_bytes = self._tx_hdr
+        pkt_bytes[2] = dev_id
+        pkt_bytes[3] = 2       # for len and cmd
+        pkt_bytes[4] = cmd
+        pkt_bytes[5] = 0xff ^ ((dev_id + 2 + cmd) & 0xff)
+        self.write_packet(pkt_bytes)
+
+    def fill_and_write_packet_iovec(self, dev_id, cmd, offset_byte, data):
+        """Writes a packet whose parameters are offset_byte followed by
+           data, without first copying data into a separate parameter
+           buffer. data should be an array of ints, or a bytearray (or bytes).
+
+           If the serial port supports scatter writes, then the header,
+           data and checksum are passed to write_scatter as separate pieces.
+        """
+        data_len = len(data)
+        hdr = self._tx_hdr
+        hdr[2] = dev_id
+        hdr[3] = data_len + 3  # for len, cmd and offset
+        hdr[4] = cmd
+        hdr[5] = offset_byte
+        checksum = dev_id + hdr[3] + cmd + offset_byte
+        if not self._scatter_write:
+            packet_len = data_len + 7
+            pkt_bytes = self.tx_buffer(packet_len)
+            pkt_bytes[0:6] = hdr
+            pkt_bytes[6:packet_len - 1] = data
+            checksum += sum_bytes(pkt_bytes, 6, packet_len - 1)
+            pkt_bytes[packet_len - 1] = 0xff ^ (checksum & 0xff)
+            self.write_tx_buffer(packet_len)
+            return
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytearray(data)
+        checksum += sum_bytes(data, 0, data_len)
+        chk = self._tx_chk
+        chk[0] = 0xff ^ (checksum & 0xff)
+        if self.show & Bus.SHOW_PACKETS:
+            dump_mem(hdr + data + chk, prefix='  W', show_ascii=True, log=log)
+        self.serial_port.write_scatter((hdr, data, chk))
+
+    def tx_buffer(self, packet_len):
+        """Returns the TX buffer, growing it if it's smaller than
+           packet_len.
+        """
+        if packet_len > len(self._tx_buf):
+            self._tx_buf = bytearray(packet_len)
+            self._tx_mv = memoryview(self._tx_buf)
+        return self._tx_buf
+
+    def write_tx_buffer(self, packet_len):
+        """Writes the first packet_len bytes of the TX buffer as a packet."""
+        self.write_packet(self._tx_mv[:packet_len])
+
+    def make_packet(self, dev_id, cmd, data=None):
+        """Allocates and fills a packet which can be written later using
+           write_packet.
+        """
+        packet_len = 6
+        if data is not None:
+            packet_len += len(data)
+        pkt_bytes = bytearray(packet_len)
+        self.fill_packet(pkt_bytes, dev_id, cmd, data)
+        return pkt_bytes
+
+    def write_packet(self, pkt_bytes):
+        """Writes a fully formed packet to the serial port."""
         if self.show & Bus.SHOW_PACKETS:
             dump_mem(pkt_bytes, prefix='  W', show_ascii=True, log=log)
         self.serial_port.write_packet(pkt_bytes)
@@ -77,12 +191,13 @@ class Bus:
            raises a BusError for any other failures.
         """
         self.send_ping(dev_id)
-        try:
-            self.read_status_packet()
-        except BusError as ex:
-            if ex.get_error_code() == packet.ErrorCode.TIMEOUT:
-                return False
-            raise ex
+        # Missing devices are common while scanning, so avoid raising and
+        # catching an exception for each one.
+        error_code, _ = self._read_status_packet_nothrow()
+        if error_code == packet.ErrorCode.TIMEOUT:
+            return False
+        if error_code != packet.ErrorCode.NONE:
+            raise BusError(error_code)
         return True
 
     def read(self, dev_id, offset, num_bytes):
@@ -99,89 +214,168 @@ class Bus:
 
         Rasises a bioloid.bus.BusError if an error occurs.
 
+        """
+        error_code, pkt = self._read_status_packet_nothrow()
+        if error_code != packet.ErrorCode.NONE:
+            raise BusError(error_code)
+        return pkt
+
+    def _read_status_packet_nothrow(self):
+        """Reads and logs a status packet.
+
+        Returns a tuple containing the error code and the packet. The error
+        code will be ErrorCode.NONE if the packet was received successfully
+        and contained no errors.
         """
         pkt = Packet(status_packet=True)
-        received_bytes = []  # List to store received bytes for logging
-        byte_index = 0  # Starting index for logging bytes
+        error_code, rx_len = self._read_packet(pkt)
+        parsed = error_code == packet.ErrorCode.NONE
+        if parsed:
+            error_code = pkt.error_code()
+        if self.show & Bus.SHOW_COMMANDS:
+            if parsed:
+                log('Rcvd Status: {} from ID: {}'.format(packet.ErrorCode(error_code), pkt.dev_id))
+            elif error_code == packet.ErrorCode.TIMEOUT:
+                log('TIMEOUT')
+            else:
+                log(BusError(error_code))
+        if self.show & Bus.SHOW_PACKETS:
+            dump_mem(memoryview(self._rx_buf)[:rx_len], prefix='  R', show_ascii=True, log=log)
+        return error_code, pkt
+
+    def _read_packet(self, pkt):
+        """Reads a status packet. The header (0xff, 0xff, device id and
+        length) is read into the RX buffer, and we sync on it using
+        find_header, which only asks for the bytes needed to complete a
+        header. The remainder of the packet is then read directly into the
+        packet. For ports which support read_exact, all of the reads share
+        a single deadline.
+
+        The remainder of the packet is only copied into the RX buffer when
+        packets are being logged.
+
+        Returns a tuple containing the ErrorCode from parsing the packet
+        (or ErrorCode.TIMEOUT), and the number of bytes saved in the RX
+        buffer.
+        """
+        read_exact = self._read_exact
+        if read_exact is None:
+            read_exact = self._read_bytewise
+            deadline = None
+        else:
+            deadline = self.serial_port.deadline()
+        rx_buf = self._rx_buf
+        rx_len = 0
+        start = 0
         while True:
-            byte = self.serial_port.read_byte()  # Assuming there is a method `read_byte` in `serial_port`
-            if byte is None:
-                # Adjust the logging format for timeouts to match the expected format from the tests
-                log('TIMEOUT')  # Log the timeout status
-                log('  R:No data')  # Adjusted log format to match the expected format in the tests
-                raise BusError(packet.ErrorCode.TIMEOUT)
-            
-            received_bytes.append(byte)  # Append the byte to the list
-            
-            # Process the byte through the packet parsing state machine
-            error_code = pkt.process_byte(byte)
-            if error_code == packet.ErrorCode.NOT_DONE:
-                continue
-            elif error_code == packet.ErrorCode.NONE:
+            result = find_header(rx_buf, start, rx_len)
+            if result >= 0:
                 break
-            else:
-                # Log the specific error status based on the error code first
-                if error_code == packet.ErrorCode.OVERHEATING:
-                    log(f'Rcvd Status: OverHeating from ID: {pkt.dev_id}')
-                elif error_code == packet.ErrorCode.CHECKSUM:
-                    log('Rcvd Status: Checksum')
-                # ... add more specific error logs if necessary
-                
-                # Log the received bytes up to the error in compact format
-                formatted_bytes = ' '.join(['{:02x}'.format(b) for b in received_bytes])
-                readable_bytes = ''.join([chr(b) if 32 <= b <= 127 else '.' for b in received_bytes])
-                padding = ' ' * (3 * (16 - len(received_bytes)) + 1)  # Adjust the padding based on the number of bytes
-                log(f"  R: 0000: {formatted_bytes}{padding}{readable_bytes}")  # Use a specific byte index as per test expectation
-                # The __str__ method of BusError will log the error status
-                raise BusError(error_code)
-        
-        # Log the status first before logging the received bytes
-        log('Rcvd Status: None from ID: {}'.format(pkt.dev_id))
-        # If packet is successfully read, log the received bytes in compact format
-        formatted_bytes = ' '.join(['{:02x}'.format(b) for b in received_bytes])
-        readable_bytes = ''.join([chr(b) if 32 <= b <= 127 else '.' for b in received_bytes])
-        padding = ' ' * (3 * (16 - len(received_bytes)) + 1)  # Adjust the padding based on the number of bytes
-        log(f"  R: 0000: {formatted_bytes}{padding}{readable_bytes}")  # Use a specific byte index as per test expectation
-        return pkt
+            # Resume the search from the start of the partial header.
+            start = rx_len - result - 4
+            new_len = rx_len - result
+            if new_len > len(rx_buf):
+                rx_buf = self._grow_rx_buf(new_len)
+            rx_len += read_exact(memoryview(rx_buf)[rx_len:new_len], deadline)
+            if rx_len < new_len:
+                return packet.ErrorCode.TIMEOUT, rx_len
+        length = rx_buf[result + 3]
+        pkt.process_header(rx_buf[result + 2], length)
+        payload = memoryview(pkt.pkt_bytes)[4:]
+        num_read = read_exact(payload, deadline)
+        if self.show & Bus.SHOW_PACKETS:
+            rx_len = self._save_rx_bytes(rx_len, payload[:num_read])
+        if num_read < length:
+            return packet.ErrorCode.TIMEOUT, rx_len
+        return pkt.process_payload(), rx_len
 
+    def _read_bytewise(self, buf, deadline=None):
+        """Reads len(buf) bytes into buf using read_byte, for ports which
+        don't support read_exact. deadline is ignored, since each call to
+        read_byte has its own timeout.
+
+        Returns the number of bytes read.
+        """
+        read_byte = self.serial_port.read_byte
+        for idx in range(len(buf)):
+            byte = read_byte()
+            if byte is None:
+                return idx
+            buf[idx] = byte
+        return len(buf)
+
+    def _save_rx_bytes(self, rx_len, data):
+        """Saves data in the RX buffer following the rx_len bytes which are
+        already there, and returns the new number of bytes saved.
+        """
+        new_len = rx_len + len(data)
+        if new_len > len(self._rx_buf):
+            self._grow_rx_buf(new_len)
+        self._rx_buf[rx_len:new_len] = data
+        return new_len
+
+    def _grow_rx_buf(self, min_len):
+        """Replaces the RX buffer with one which is at least min_len bytes
+        long, preserving its contents.
+        """
+        rx_buf = bytearray(max(min_len, 2 * len(self._rx_buf)))
+        rx_buf[:len(self._rx_buf)] = self._rx_buf
+        self._rx_buf = rx_buf
+        return rx_buf
 
     def reset(self, dev_id):
-        """Sends a RESET request.
+        """Sends a RESET request, and waits for the status packet unless
+           the request was broadcast.
 
-           Raises a bus.Error if any errors occur.
+           Raises a bus.Error if any errors occur, including an error
+           reported by the device.
         """
         self.send_reset(dev_id)
-        if dev_id == packet.Id.BROADCAST:
-            return packet.ErrorCode.NONE
-        pkt = self.read_status_packet()
-        return pkt.error_code()
+        if dev_id != packet.Id.BROADCAST:
+            self.read_status_packet()
 
     def scan(self, start_id=0, num_ids=32, dev_found=None, dev_missing=None):
         """Scans the bus, calling devFound(self, dev) for each device
         which responds, and dev_missing(self, dev) for each device
         which doesn't.
 
+        If the serial port supports it, a shorter timeout is used for
+        each ping, so that missing devices are detected quickly.
+
         Returns true if any devices were found.
         """
         end_id = start_id + num_ids - 1
         if end_id >= packet.Id.BROADCAST:
             end_id = packet.Id.BROADCAST - 1
         some_dev_found = False
-        for dev_id in range(start_id, end_id + 1):
-            if self.ping(dev_id):
-                some_dev_found = True
-                if dev_found:
-                    dev_found(self, dev_id)
-            else:
-                if dev_missing:
-                    dev_missing(self, dev_id)
+        use_ping_timeout = getattr(self.serial_port, 'use_ping_timeout', None)
+        if use_ping_timeout:
+            use_ping_timeout(True)
+        try:
+            for dev_id in range(start_id, end_id + 1):
+                if self.ping(dev_id):
+                    some_dev_found = True
+                    if dev_found:
+                        dev_found(self, dev_id)
+                else:
+                    if dev_missing:
+                        dev_missing(self, dev_id)
+        finally:
+            if use_ping_timeout:
+                use_ping_timeout(False)
         return some_dev_found
 
     def send_ping(self, dev_id):
         """Sends a ping to a device."""
         if self.show & Bus.SHOW_COMMANDS:
             log('Sending PING to ID {}'.format(dev_id))
-        self.fill_and_write_packet(dev_id, packet.Command.PING)
+        # A dict is used rather than a list, so that an invalid id (i.e. -1)
+        # reaches make_packet, which rejects it.
+        pkt = self._ping_pkts.get(dev_id)
+        if pkt is None:
+            pkt = self.make_packet(dev_id, packet.Command.PING)
+            self._ping_pkts[dev_id] = pkt
+        self.write_packet(pkt)
 
     def send_read(self, dev_id, offset, num_bytes):
         """Sends a READ request to read data from the device's control
@@ -190,7 +384,14 @@ class Bus:
         if self.show & Bus.SHOW_COMMANDS:
             log('Sending READ to ID {} offset 0x{:02x} len {}'.format(
                 dev_id, offset, num_bytes))
-        self.fill_and_write_packet(dev_id, packet.Command.READ, bytearray((offset, num_bytes)))
+        key = (dev_id, offset, num_bytes)
+        pkt = self._read_pkts.get(key)
+        if pkt is None:
+            if len(self._read_pkts) >= Bus.READ_CACHE_SIZE:
+                self._read_pkts.clear()
+            pkt = self.make_packet(dev_id, packet.Command.READ, bytearray((offset, num_bytes)))
+            self._read_pkts[key] = pkt
+        self.write_packet(pkt)
 
     def send_reset(self, dev_id):
         """Sends a RESET command to the device, which causes it to reset the
@@ -201,7 +402,10 @@ class Bus:
                 log('Broadcasting RESET')
             else:
                 log('Sending RESET to ID {}'.format(dev_id))
-        self.fill_and_write_packet(dev_id, packet.Command.RESET)
+        if dev_id == packet.Id.BROADCAST:
+            self.write_packet(self._reset_pkt)
+        else:
+            self.fill_and_write_packet(dev_id, packet.Command.RESET)
 
     def send_write(self, dev_id, offset, data, deferred=False):
         """Sends a WRITE request if deferred is False, or REG_WRITE
@@ -219,10 +423,7 @@ class Bus:
             else:
                 log('Sending {} to ID {} offset 0x{:02x} len {}'.format(cmd_str, dev_id, offset, len(data)))
         cmd = packet.Command.REG_WRITE if deferred else packet.Command.WRITE
-        pkt_data = bytearray(len(data))
-        pkt_data[0] = offset
-        pkt_data[1:] = data
-        self.fill_and_write_packet(dev_id, cmd, pkt_data)
+        self.fill_and_write_packet_iovec(dev_id, cmd, offset, data)
 
     def sync_write(self, dev_ids, offset, values):
         """Sets up a synchroous write command.
@@ -233,30 +434,52 @@ class Bus:
 
         values should be an array of bytearrays. There should be one bytearray
         for each dev_id, and each bytearray should be of the same length.
+        values may also be a single bytearray containing the values for
+        each dev_id one after the other, which avoids creating a bytearray
+        per device.
 
         raises ValueError if the dimensionality of values is incorrect.
         """
+        num_ids = len(dev_ids)
+        flat = isinstance(values, (bytes, bytearray, memoryview))
+        if flat:
+            bytes_per_id = len(values) // num_ids if num_ids else 0
+        else:
+            bytes_per_id = len(values[0])
         if self.show & Bus.SHOW_COMMANDS:
             ids = ', '.join(['{}'.format(id) for id in dev_ids])
-            log('Sending SYNC_WRITE to IDs {} offset 0x{:02x} len {}'.format(ids, offset, len(values[0])))
-        num_ids = len(dev_ids)
-        if num_ids != len(values):
+            log('Sending SYNC_WRITE to IDs {} offset 0x{:02x} len {}'.format(ids, offset, bytes_per_id))
+        if flat:
+            if num_ids == 0 or len(values) != num_ids * bytes_per_id:
+                raise ValueError('len(values) = {} must be a multiple of len(dev_ids) = {}'.format(len(values), num_ids))
+            values_mv = memoryview(values)
+        elif num_ids != len(values):
             raise ValueError('len(dev_ids) = {} must match len(values) = {}'.format(num_ids, len(values)))
-        bytes_per_id = len(values[0])
-        param_len = num_ids * (bytes_per_id + 1) + 2
-        data = bytearray(param_len)
-        data[0] = offset
-        data[1] = bytes_per_id
-        data_idx = 2
+        # The parameters are written directly into the TX buffer.
+        packet_len = num_ids * (bytes_per_id + 1) + 8
+        pkt_bytes = self.tx_buffer(packet_len)
+        pkt_bytes[0] = 0xff
+        pkt_bytes[1] = 0xff
+        pkt_bytes[2] = packet.Id.BROADCAST
+        pkt_bytes[3] = packet_len - 4
+        pkt_bytes[4] = packet.Command.SYNC_WRITE
+        pkt_bytes[5] = offset
+        pkt_bytes[6] = bytes_per_id
+        pkt_idx = 7
+        values_idx = 0
         for id_idx in range(num_ids):
-            if len(values[id_idx]) != bytes_per_id:
-                raise ValueError('len(values[{}]) not equal {}'.format(id_idx, bytes_per_id))
-            data[data_idx] = dev_ids[id_idx]
-            data_idx += 1
-            data[data_idx:data_idx + bytes_per_id] = values[id_idx]
-            data_idx += bytes_per_id
-
-        self.fill_and_write_packet(packet.Id.BROADCAST, packet.Command.SYNC_WRITE, data)
+            pkt_bytes[pkt_idx] = dev_ids[id_idx]
+            pkt_idx += 1
+            if flat:
+                pkt_bytes[pkt_idx:pkt_idx + bytes_per_id] = values_mv[values_idx:values_idx + bytes_per_id]
+                values_idx += bytes_per_id
+            else:
+                if len(values[id_idx]) != bytes_per_id:
+                    raise ValueError('len(values[{}]) not equal {}'.format(id_idx, bytes_per_id))
+                pkt_bytes[pkt_idx:pkt_idx + bytes_per_id] = values[id_idx]
+            pkt_idx += bytes_per_id
+        pkt_bytes[packet_len - 1] = 0xff ^ (sum_bytes(pkt_bytes, 2, packet_len - 1) & 0xff)
+        self.write_tx_buffer(packet_len)
 
     def write(self, dev_id, offset, data, deferred=False):
         """Sends a WRITE request if deferred is False, or a REG_WRITE
@@ -265,10 +488,11 @@ class Bus:
 
         data should be an array of ints, or a bytearray.
 
-        Raises a bus.Error if any errors occur.
+        The status packet is waited for unless the request was broadcast.
+
+        Raises a bus.Error if any errors occur, including an error
+        reported by the device.
         """
         self.send_write(dev_id, offset, data, deferred)
-        if dev_id == packet.Id.BROADCAST:
-            return packet.ErrorCode.NONE
-        pkt = self.read_status_packet()
-        return pkt.error_code()
+        if dev_id != packet.Id.BROADCAST:
+            self.read_status_packet()
@@ -3,6 +3,79 @@ devices on the bioloid bus.
 
 """
 
+import sys
+if sys.implementation.name == 'micropython':    # pragma: no cover
+    import micropython
+
+    @micropython.viper
+    def sum_bytes(buf, start: int, end: int) -> int:
+        """Returns the sum of buf[start:end]. Using viper means that the
+           loop runs as native code using unboxed integers.
+        """
+        data = ptr8(buf)
+        total = 0
+        idx = start
+        while idx < end:
+            total += data[idx]
+            idx += 1
+        return total
+
+    @micropython.viper
+    def find_header(buf, start: int, end: int) -> int:
+        """Searches buf[start:end] for a status packet header. See the
+           non-viper version below for the return value. Using viper means
+           that the sync runs as native code rather than calling
+           Packet.process_byte for each byte.
+        """
+        data = ptr8(buf)
+        idx = start
+        while idx < end:
+            avail = end - idx
+            if (data[idx] == 0xff and (avail < 2 or data[idx + 1] == 0xff) and
+                    (avail < 3 or data[idx + 2] != 0xff) and
+                    (avail < 4 or data[idx + 3] >= 2)):
+                if avail >= 4:
+                    return idx
+                return avail - 4
+            idx += 1
+        return -4
+else:
+    def sum_bytes(buf, start, end):
+        """Returns the sum of buf[start:end]. The memoryview avoids
+           copying the slice.
+        """
+        return sum(memoryview(buf)[start:end])
+
+    def find_header(buf, start, end):
+        """Searches the bytearray buf[start:end] for a status packet header
+           (0xff, 0xff, device id and length). Extra 0xff's before the
+           device id are skipped, and a length less than 2 isn't valid,
+           since a status packet always contains the error and checksum.
+
+           Returns the index of the header if a complete one was found.
+           Otherwise, a negative number is returned, which is minus the
+           number of bytes which need to be added at buf[end] to complete
+           the partial header at the end of buf (or to read a new header
+           if there isn't one).
+        """
+        idx = start
+        while True:
+            idx = buf.find(b'\xff\xff', idx, end)
+            if idx < 0:
+                # A trailing 0xff may be the start of a header.
+                if end > start and buf[end - 1] == 0xff:
+                    return -3
+                return -4
+            avail = end - idx
+            if avail < 3:
+                return -2
+            if buf[idx + 2] != 0xff:
+                if avail < 4:
+                    return -1
+                if buf[idx + 3] >= 2:
+                    return idx
+            idx += 1
+
 class Id:
     """Constants for reserved IDs."""
 
@@ -241,3 +314,36 @@ class Packet:
             self.checksum += byte
         self.byte_index += 1
         return ErrorCode.NOT_DONE
+
+    def process_header(self, dev_id, length):
+        """Sets up the packet as if process_byte had just consumed the
+        leading 0xff's, the device id and the length byte.
+        """
+        self.dev_id = dev_id
+        self.length = length
+        self.checksum = dev_id + length
+        self.pkt_bytes = bytearray(length + 4)
+        self.pkt_bytes[0] = 0xff
+        self.pkt_bytes[1] = 0xff
+        self.pkt_bytes[2] = dev_id
+        self.pkt_bytes[3] = length
+        self.byte_index = 4
+
+    def process_payload(self):
+        """Processes all of the bytes following the length byte (i.e.
+        the command, parameters and checksum) at once. This should only
+        be called after process_header has been called, and the
+        self.length bytes have been placed in pkt_bytes[4:].
+
+        Returns ErrorCode.NONE if the packet was received successfully,
+        and ErrorCode.CHECKSUM if a checksum error is detected.
+        """
+        self.cmd = self.pkt_bytes[4]
+        self.byte_index = 0
+        checksum = self.checksum + sum_bytes(self.pkt_bytes, 5, len(self.pkt_bytes) - 1)
+        if not self.status_packet:
+            checksum += self.cmd
+        self.checksum = ~checksum & 0xff
+        if self.checksum == self.pkt_bytes[-1]:
+            return ErrorCode.NONE
+        return ErrorCode.CHECKSUM
@@ -3,28 +3,70 @@ devices through a serial port.
 
 """
 
+import time
+
 import serial
-import select
+
 
 class SerialPort(object):
     """Implements a PySerial port for use with the Bioloid Bus.
 
     """
 
-    def __init__(self, port, baud=1000000):
+    PING_TIMEOUT_MIN = 0.002    # Shortest default timeout used while scanning
+
+    def __init__(self, port, baud=1000000, scatter_write=False, ping_timeout=None,
+                 timeout=0.005, inter_byte_timeout=None):
+        # timeout is how long to wait for the first byte of a response,
+        # which allows for the max Return Delay time with plenty to spare.
+        # read_exact adds the time to receive the bytes it's reading at the
+        # baud rate, so the timeout doesn't need to scale with the baud rate.
+        #
+        # inter_byte_timeout is passed through to pyserial. On POSIX
+        # pyserial implements it using the termios VTIME setting, which
+        # has a resolution of 0.1 seconds, so values less than 0.1 have
+        # no effect there. read_exact doesn't depend on it, since it keeps
+        # reading until all of the bytes arrive or the timeout expires.
+        self.timeout = timeout
+        # Time taken to transmit a byte (start bit, 8 data bits and stop bit).
+        self.byte_time = 10 / baud
         self.serial_port = serial.Serial(port=port,
                                          baudrate=baud,
-                                         timeout=0.1,
+                                         timeout=self.timeout,
+                                         inter_byte_timeout=inter_byte_timeout,
                                          bytesize=serial.EIGHTBITS,
                                          parity=serial.PARITY_NONE,
                                          stopbits=serial.STOPBITS_ONE,
                                          xonxoff=False,
                                          rtscts=False,
                                          dsrdtr=False)
+        # Cache the bound methods used on every transfer.
+        self._read = self.serial_port.read
+        self._write = self.serial_port.write
+        # Bytes which have been read from the serial port but not yet
+        # returned by read_byte/read_into.
+        self.rx_buf = b''
+        self.rx_idx = 0
+        # When True, the Bus may write a packet in pieces using write_scatter
+        # rather than assembling it and calling write_packet.
+        self.supports_scatter_write = scatter_write
+        # Timeout used while scanning. By default this allows for the max
+        # Return Delay time plus twice the time it takes to receive a 6 byte
+        # status packet, but never less than PING_TIMEOUT_MIN. It's never
+        # longer than the regular timeout, unless that's None (blocking).
+        #
+        # USB serial adapters add their own latency: FTDI adapters default
+        # to a 16 msec latency timer, which needs to be lowered (i.e. to 1)
+        # for short timeouts to work.
+        if ping_timeout is None:
+            ping_timeout = max(SerialPort.PING_TIMEOUT_MIN, 0.001 + 120 / baud)
+            if self.timeout is not None:
+                ping_timeout = min(self.timeout, ping_timeout)
+        self.ping_timeout = ping_timeout
 
     def is_byte_available(self):
-        readable, _, _ = select.select([self.serial_port.fileno()], [], [], 0)
-        return bool(readable)
+        """Returns True if a byte can be read without blocking."""
+        return self.rx_idx < len(self.rx_buf) or self.serial_port.in_waiting > 0
 
     def read_byte(self):
         """Reads a byte from the bus. This function will return None if
@@ -34,15 +76,117 @@ class SerialPort(object):
         default is 500 usec). This represents the minimum time between
         receiving a packet and sending a response.
 
+        Rather than reading one byte at a time, we read everything which
+        the driver has already buffered and return it from rx_buf on
+        subsequent calls.
+
+        pyserial returns b'' when a timeout occurs, which is how a timeout
+        is distinguished from receiving a byte.
+
+        """
+        if self.rx_idx >= len(self.rx_buf):
+            # When nothing is waiting, read(1) blocks using the configured
+            # timeout, which is what allows timeouts to be detected.
+            data = self._read(max(1, self.serial_port.in_waiting))
+            if not data:
+                return None
+            self.rx_buf = data
+            self.rx_idx = 0
+        byte = self.rx_buf[self.rx_idx]
+        self.rx_idx += 1
+        return byte
+
+    def deadline(self):
+        """Returns the time.monotonic() value by which a response should
+        have been received, using the current timeout. Returns None if
+        the timeout is None (i.e. blocking).
+
         """
-        data = self.serial_port.read()
-        if data:
-            return data[0]
-        return None
+        if self.serial_port.timeout is None:
+            return None
+        return time.monotonic() + self.serial_port.timeout
+
+    def read_exact(self, buf, deadline=None):
+        """Reads len(buf) bytes from the bus into buf, which should be a
+        bytearray or memoryview. pyserial can return fewer bytes than
+        requested (i.e. when the timeout expires), so we keep reading until
+        all of the bytes arrive or deadline (from self.deadline()) passes.
+        The deadline defaults to one computed now. It's extended by the time
+        it takes to receive len(buf) bytes at the baud rate, since at low baud
+        rates a long status packet takes much longer than the timeout to
+        arrive.
+
+        Returns the number of bytes read, which will be less than len(buf)
+        if the deadline passes.
+
+        """
+        if deadline is None:
+            deadline = self.deadline()
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        num_bytes = len(buf)
+        if deadline is not None:
+            deadline += num_bytes * self.byte_time
+        num_read = self.read_into(buf)
+        while num_read < num_bytes and (deadline is None or time.monotonic() < deadline):
+            num_read += self.serial_port.readinto(buf[num_read:])
+        return num_read
+
+    def read_into(self, buf):
+        """Reads len(buf) bytes from the bus directly into buf, which
+        should be a bytearray or memoryview. Returns the number of bytes
+        read, which will be less than len(buf) if a timeout occurs.
+
+        """
+        buf_len = len(buf)
+        num_buffered = min(len(self.rx_buf) - self.rx_idx, buf_len)
+        if num_buffered > 0:
+            buf[:num_buffered] = self.rx_buf[self.rx_idx:self.rx_idx + num_buffered]
+            self.rx_idx += num_buffered
+            if num_buffered == buf_len:
+                return buf_len
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        return num_buffered + self.serial_port.readinto(buf[num_buffered:])
+
+    def use_ping_timeout(self, enable):
+        """Switches between the ping timeout (which is used while
+        scanning) and the regular timeout.
+
+        """
+        self.serial_port.timeout = self.ping_timeout if enable else self.timeout
+
+    def write_scatter(self, pieces):
+        """Writes a packet which is supplied as a sequence of pieces
+        (i.e. header, data and checksum). This is used by the Bus when
+        supports_scatter_write is True.
+
+        """
+        self._begin_packet()
+        for piece in pieces:
+            self._write(piece)
+        self._end_packet()
 
     def write_packet(self, packet_data):
         """Function implemented by a derived class which actually writes
         the data to a device.
 
         """
-        self.serial_port.write(packet_data)
+        self._begin_packet()
+        self._write(packet_data)
+        self._end_packet()
+
+    def _begin_packet(self):
+        """Discards any stale received data before a packet is written, so
+        that the next read returns the response to the packet.
+
+        """
+        self.serial_port.reset_input_buffer()
+        self.rx_idx = len(self.rx_buf)
+
+    def _end_packet(self):
+        """Waits for a packet to be transmitted, so that the Bus can start
+        reading the response immediately.
+
+        """
+        self.serial_port.flush()
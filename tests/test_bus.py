@@ -12,6 +12,7 @@ import unittest
 from bioloid.bus import Bus, BusError
 from bioloid import log
 from bioloid import packet
+from bioloid.dump_mem import dump_mem
 
 def make_packet_bytes(pkt_str):
     return binascii.unhexlify(pkt_str.replace(' ', ''))
@@ -92,6 +93,54 @@ class FakePort:
                 self.rsp_idx = 0
 
 
+class ExactFakePort(FakePort):
+    """Implements a port which supports reading an exact number of bytes.
+    The bytes of all of the queued responses are returned as a single stream.
+    """
+
+    def __init__(self, test):
+        """Constructor
+        """
+        super().__init__(test)
+        self.num_deadlines = 0
+        self.deadlines = []
+
+    def deadline(self):
+        """Returns a new deadline, which is just a count of the deadlines
+           handed out so far.
+        """
+        self.num_deadlines += 1
+        return self.num_deadlines
+
+    def read_exact(self, buf, deadline=None):
+        """Reads up to len(buf) bytes from the queued responses into buf,
+           and records the deadline which was used.
+        """
+        self.deadlines.append(deadline)
+        for idx in range(len(buf)):
+            byte = self.read_byte()
+            if byte is None:
+                return idx
+            buf[idx] = byte
+        return len(buf)
+
+
+class ScatterFakePort(FakePort):
+    """Implements a port which supports scatter writes. The pieces are
+       joined and verified as a single packet.
+    """
+
+    supports_scatter_write = True
+
+    def write_scatter(self, pieces):
+        """Verifies the packet formed by joining the pieces.
+        """
+        pkt = bytearray()
+        for piece in pieces:
+            pkt += bytearray(piece)
+        self.write_packet(pkt)
+
+
 class TestBus(unittest.TestCase):
 
     def clear_log(self):
@@ -101,10 +150,10 @@ class TestBus(unittest.TestCase):
         self.log_lines.append(' '.join([str(arg) for arg in args]))
         # print(*args)
 
-    def setup_bus(self, cmd, rsp):
+    def setup_bus(self, cmd, rsp, port_class=FakePort):
         self.clear_log()
         log.log_to_fn(self.log)
-        port = FakePort(self)
+        port = port_class(self)
         port.queue_command(cmd)
         port.queue_response(rsp)
         bus = Bus(port, show=Bus.SHOW_COMMANDS | Bus.SHOW_PACKETS)
@@ -166,6 +215,13 @@ class TestBus(unittest.TestCase):
             '  R: 0000: ff ff 01 02 00 00                               ......'
         ])
 
+    def test_ping_invalid_id(self):
+        # A negative id isn't mistaken for a cached broadcast ping
+        bus = self.setup_bus('ff ff fe 02 01 fe', None)
+        bus.show = Bus.SHOW_NONE
+        self.assertEqual(False, bus.ping(packet.Id.BROADCAST))
+        self.assertRaises(ValueError, bus.send_ping, -1)
+
     def test_ping_overheat(self):
         # Send ping to device ID 1
         bus = self.setup_bus('ff ff 01 02 01 fb', 'ff ff 01 02 04 fc')
@@ -190,6 +246,116 @@ class TestBus(unittest.TestCase):
             '  R: 0000: ff ff 01 03 00 20 db                            ..... .'
         ])
 
+    def test_read_cache(self):
+        # Repeated READs reuse the same packet
+        bus = self.setup_bus(['ff ff 01 04 02 2b 01 cc'] * 2, ['ff ff 01 03 00 20 db'] * 2)
+        bus.show = Bus.SHOW_NONE
+        self.assertEqual(bytearray([32]), bus.read(1, 0x2b, 1))
+        self.assertEqual(bytearray([32]), bus.read(1, 0x2b, 1))
+        self.assertEqual(1, len(bus._read_pkts))
+
+    def test_read_cache_limit(self):
+        bus = self.setup_bus(None, None)
+        bus.show = Bus.SHOW_NONE
+        bus.serial_port.write_packet = lambda pkt: None
+        for offset in range(Bus.READ_CACHE_SIZE + 1):
+            bus.send_read(1, offset, 1)
+        self.assertEqual(1, len(bus._read_pkts))
+
+    def test_read_cache_range(self):
+        # Out of range arguments aren't confused with a cached packet
+        bus = self.setup_bus(None, None)
+        bus.show = Bus.SHOW_NONE
+        bus.serial_port.write_packet = lambda pkt: None
+        bus.send_read(1, 0x2c, 0)
+        self.assertRaises(ValueError, bus.send_read, 1, 0x2b, 256)
+
+    def test_read_quiet(self):
+        # Nothing is logged when show is SHOW_NONE
+        bus = self.setup_bus('ff ff 01 04 02 2b 01 cc', 'ff ff 01 03 00 20 db')
+        bus.show = Bus.SHOW_NONE
+        self.assertEqual(bytearray([32]), bus.read(1, 0x2b, 1))
+        self.assertEqual(self.log_lines, [])
+
+    def check_read_long(self, port_class):
+        # Status packets larger than the initial RX buffer are still logged
+        params = bytearray(range(0x20, 0x48))
+        rsp = bytearray((0x00, 0xff, 0xff, 0x01, len(params) + 2, 0x00)) + params
+        rsp.append(~(sum(rsp[3:5]) + sum(params)) & 0xff)
+        bus = self.setup_bus('ff ff 01 04 02 00 28 d0', binascii.hexlify(rsp).decode('ascii'), port_class)
+        bus.show = Bus.SHOW_PACKETS
+        self.assertEqual(params, bus.read(1, 0x00, len(params)))
+        expected = []
+        dump_mem(rsp, prefix='  R', show_ascii=True, log=expected.append)
+        self.assertEqual(self.log_lines[-len(expected):], expected)
+
+    def test_read_long(self):
+        self.check_read_long(FakePort)
+
+    def test_read_long_exact(self):
+        self.check_read_long(ExactFakePort)
+
+    def test_read_exact(self):
+        bus = self.setup_bus('ff ff 01 04 02 2b 01 cc', 'ff ff 01 03 00 20 db', ExactFakePort)
+        params = bus.read(1, 0x2b, 1)
+        self.assertEqual(bytearray([32]), params)
+        self.assertEqual(self.log_lines, [
+            'Sending READ to ID 1 offset 0x2b len 1',
+            '  W: 0000: ff ff 01 04 02 2b 01 cc                         .....+..',
+            'Rcvd Status: None from ID: 1',
+            '  R: 0000: ff ff 01 03 00 20 db                            ..... .'
+        ])
+
+    def test_read_resync(self):
+        # Ports which only support read_byte sync on the header the same way
+        bus = self.setup_bus('ff ff 01 04 02 2b 01 cc', '00 ff 12 ff ff 01 01 ff ff ff 01 03 00 20 db')
+        bus.show = Bus.SHOW_PACKETS
+        self.assertEqual(bytearray([32]), bus.read(1, 0x2b, 1))
+        expected = []
+        dump_mem(make_packet_bytes('00 ff 12 ff ff 01 01 ff ff ff 01 03 00 20 db'),
+                 prefix='  R', show_ascii=True, log=expected.append)
+        self.assertEqual(self.log_lines[-len(expected):], expected)
+
+    def test_read_exact_resync(self):
+        bus = self.setup_bus('ff ff 01 04 02 2b 01 cc', '00 ff 12 ff ff 01 01 ff ff ff 01 03 00 20 db',
+                             ExactFakePort)
+        bus.show = Bus.SHOW_NONE
+        self.assertEqual(bytearray([32]), bus.read(1, 0x2b, 1))
+
+    def test_read_exact_deadline(self):
+        # Every read for a packet, including resyncs, shares one deadline
+        bus = self.setup_bus('ff ff 01 04 02 2b 01 cc', '00 ff ff 01 03 00 20 db', ExactFakePort)
+        bus.show = Bus.SHOW_NONE
+        self.assertEqual(bytearray([32]), bus.read(1, 0x2b, 1))
+        port = bus.serial_port
+        self.assertEqual(1, port.num_deadlines)
+        self.assertEqual([1, 1, 1], port.deadlines)
+
+    def test_read_exact_timeout(self):
+        for rsp in (None, 'ff ff 01', 'ff ff 01 03 00 20', '00 ff ff ff'):
+            bus = self.setup_bus('ff ff 01 02 01 fb', rsp, ExactFakePort)
+            bus.show = Bus.SHOW_NONE
+            self.assertEqual(False, bus.ping(1))
+
+    def test_read_exact_checksum(self):
+        bus = self.setup_bus('ff ff 01 04 02 2b 01 cc', 'ff ff 01 03 00 20 00', ExactFakePort)
+        self.assertRaises(BusError, bus.read, 1, 0x2b, 1)
+        self.assertEqual(self.log_lines, [
+            'Sending READ to ID 1 offset 0x2b len 1',
+            '  W: 0000: ff ff 01 04 02 2b 01 cc                         .....+..',
+            'Rcvd Status: Checksum',
+            '  R: 0000: ff ff 01 03 00 20 00                            ..... .'
+        ])
+
+    def test_read_exact_short(self):
+        bus = self.setup_bus('ff ff 01 04 02 2b 01 cc', 'ff ff 01 03 00', ExactFakePort)
+        bus.show = Bus.SHOW_PACKETS
+        with self.assertRaises(BusError) as ctx:
+            bus.read(1, 0x2b, 1)
+        self.assertEqual(packet.ErrorCode.TIMEOUT, ctx.exception.get_error_code())
+        self.assertEqual(self.log_lines[-1],
+            '  R: 0000: ff ff 01 03 00                                  .....')
+
     def test_reset_broadcast(self):
         # Broadcast a reset command (no response)
         bus = self.setup_bus('ff ff fe 02 06 f9', None)
@@ -204,7 +370,7 @@ class TestBus(unittest.TestCase):
         # Send reset to device ID 1
         # Status response - no errors
         bus = self.setup_bus('ff ff 01 02 06 f6', 'ff ff 01 02 00 fc')
-        self.assertEqual(packet.ErrorCode.NONE, bus.reset(1))
+        bus.reset(1)
         self.assertEqual(self.log_lines, [
             'Sending RESET to ID 1',
             '  W: 0000: ff ff 01 02 06 f6                               ......',
@@ -255,6 +421,15 @@ class TestBus(unittest.TestCase):
             'dev_missing: 2',
         ])
 
+    def test_scan_ping_timeout(self):
+        # The ping timeout is only used for the duration of the scan
+        bus = self.setup_bus(['ff ff 01 02 01 fb', 'ff ff 02 02 01 fa'], 'ff ff 01 02 00 fc')
+        port = bus.serial_port
+        port.ping_timeout_calls = []
+        port.use_ping_timeout = port.ping_timeout_calls.append
+        self.assertEqual(True, bus.scan(start_id=1, num_ids=2))
+        self.assertEqual(port.ping_timeout_calls, [True, False])
+
     def test_scan_broadcast(self):
         bus = self.setup_bus('ff ff fd 02 01 ff', None)
         self.assertEqual(False, bus.scan(start_id=253, num_ids=2))
@@ -276,6 +451,20 @@ class TestBus(unittest.TestCase):
             '  R: 0000: ff ff 01 03 00 20 db                            ..... .'
         ])
 
+    def test_write_error(self):
+        # An error reported by the device is raised rather than returned
+        bus = self.setup_bus('ff ff 01 04 03 11 01 e5', 'ff ff 01 02 04 fc')
+        bus.show = Bus.SHOW_NONE
+        with self.assertRaises(BusError) as ctx:
+            bus.write(1, 0x11, b'\x01')
+        self.assertEqual(packet.ErrorCode.OVERHEATING, ctx.exception.get_error_code())
+
+    def test_write_scatter(self):
+        bus = self.setup_bus('ff ff 01 05 03 1e 00 02 d6', 'ff ff 01 02 00 fc', ScatterFakePort)
+        bus.show = Bus.SHOW_NONE
+        bus.write(1, 0x1e, [0x00, 0x02])
+        self.assertEqual(bus.serial_port.cmd_queue, [])
+
     def test_write_brodcast(self):
         # Turn the LED (offset 0x11) on for the Dynamixel actuator with an ID of 1
         bus = self.setup_bus('ff ff fe 04 03 11 01 e8', None)
@@ -305,6 +494,34 @@ class TestBus(unittest.TestCase):
             '  W: 0000: ff ff fe 08 83 11 01 01 01 02 01 5f             ..........._'
         ])
 
+    def test_sync_write_flat(self):
+        # The values can also be supplied as a single bytearray
+        bus = self.setup_bus('ff ff fe 0a 83 1e 02 01 00 02 02 01 02 4c', None)
+        bus.sync_write([1, 2], 0x1e, bytearray((0x00, 0x02, 0x01, 0x02)))
+        self.assertEqual(self.log_lines, [
+            'Sending SYNC_WRITE to IDs 1, 2 offset 0x1e len 2',
+            '  W: 0000: ff ff fe 0a 83 1e 02 01 00 02 02 01 02 4c       .............L'
+        ])
+
+    def test_sync_write_flat_error(self):
+        bus = self.setup_bus(None, None)
+        self.assertRaises(ValueError, bus.sync_write, [1, 2], 0x1e, bytearray((0x00, 0x02, 0x01)))
+
+    def test_sync_write_large(self):
+        # Packets larger than the initial TX buffer cause it to grow
+        dev_ids = list(range(1, 51))
+        values = [bytearray((0x00, 0x02, 0x00, 0x01))] * len(dev_ids)
+        params = bytearray((0x1e, 4))
+        for dev_id in dev_ids:
+            params.append(dev_id)
+            params += values[0]
+        pkt = bytearray((0xff, 0xff, 0xfe, len(params) + 2, 0x83)) + params
+        pkt.append(~sum(pkt[2:]) & 0xff)
+        bus = self.setup_bus(binascii.hexlify(pkt).decode('ascii'), None)
+        bus.show = Bus.SHOW_NONE
+        bus.sync_write(dev_ids, 0x1e, values)
+        self.assertEqual(bus.serial_port.cmd_queue, [])
+
     def test_sync_write_error(self):
         # Turn the LED (offset 0x11) on for the Dynamixel actuator with IDs of 1 and 2
         bus = self.setup_bus('ff ff fe 08 83 11 01 01 01 02 01 5f', None)
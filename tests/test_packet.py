@@ -2,10 +2,11 @@
 
 # This file tests the packet parser
 
+import itertools
 import unittest
 import binascii
 
-from bioloid.packet import Command, ErrorCode, Id, Packet
+from bioloid.packet import Command, ErrorCode, Id, Packet, find_header, sum_bytes
 
 class TestId(unittest.TestCase):
 
@@ -80,6 +81,61 @@ class TestErrorCode(unittest.TestCase):
         self.assertEqual(ErrorCode.CHECKSUM, ErrorCode.parse('CheckSum'))
         self.assertRaises(ValueError, ErrorCode.parse, 'xxx')
 
+class TestSumBytes(unittest.TestCase):
+
+    def test_sum_bytes(self):
+        buf = bytearray(range(0xf0, 0x100))
+        self.assertEqual(sum(buf[2:-1]), sum_bytes(buf, 2, len(buf) - 1))
+        self.assertEqual(0, sum_bytes(buf, 5, 5))
+
+
+def find_header_bytewise(buf, start, end):
+    """Same algorithm as the viper version of find_header."""
+    idx = start
+    while idx < end:
+        avail = end - idx
+        if (buf[idx] == 0xff and (avail < 2 or buf[idx + 1] == 0xff) and
+                (avail < 3 or buf[idx + 2] != 0xff) and
+                (avail < 4 or buf[idx + 3] >= 2)):
+            if avail >= 4:
+                return idx
+            return avail - 4
+        idx += 1
+    return -4
+
+
+class TestFindHeader(unittest.TestCase):
+
+    def find(self, data_str, start=0):
+        buf = bytearray(binascii.unhexlify(data_str.replace(' ', '')))
+        return find_header(buf, start, len(buf))
+
+    def test_find_header(self):
+        self.assertEqual(0, self.find('ff ff 01 02 00 fc'))
+        self.assertEqual(-4, self.find(''))
+        self.assertEqual(-4, self.find('00 12'))
+        # Partial headers need the rest of the header
+        self.assertEqual(-3, self.find('00 ff'))
+        self.assertEqual(-2, self.find('ff ff'))
+        self.assertEqual(-2, self.find('ff ff ff'))
+        self.assertEqual(-1, self.find('ff ff 01'))
+        # Extra 0xff's and bad lengths are skipped
+        self.assertEqual(2, self.find('ff ff ff ff 01 03'))
+        self.assertEqual(5, self.find('ff ff 01 01 00 ff ff 01 02'))
+        self.assertEqual(-4, self.find('ff ff 01 01'))
+        # The search starts at start
+        self.assertEqual(-4, self.find('ff ff 01 02', start=1))
+
+    def test_find_header_bytewise(self):
+        # Check every short buffer made from the interesting byte values
+        for buf_len in range(7):
+            for data in itertools.product((0x00, 0x01, 0x02, 0xff), repeat=buf_len):
+                buf = bytearray(data)
+                for start in range(buf_len + 1):
+                    self.assertEqual(find_header_bytewise(buf, start, buf_len),
+                                     find_header(buf, start, buf_len), buf)
+
+
 class TestPacket(unittest.TestCase):
 
     def parse_packet(self, data_str, expected_err=ErrorCode.NONE, status_packet=False):
@@ -94,6 +150,26 @@ class TestPacket(unittest.TestCase):
                 self.assertEqual(err, ErrorCode.NOT_DONE)
         return pkt
 
+    def parse_payload(self, data_str, expected_err=ErrorCode.NONE, status_packet=False):
+        data = binascii.unhexlify(data_str.replace(' ', ''))
+        pkt = Packet(status_packet=status_packet)
+        pkt.process_header(data[2], data[3])
+        pkt.pkt_bytes[4:] = data[4:]
+        self.assertEqual(pkt.process_payload(), expected_err)
+        return pkt
+
+    def test_payload(self):
+        pkt = self.parse_payload('ff ff fe 04 03 03 01 f6')
+        self.assertEqual(pkt.dev_id, 0xfe)
+        self.assertEqual(pkt.cmd, Command.WRITE)
+        self.assertEqual(pkt.params(), bytearray([0x03, 0x01]))
+        self.parse_payload('ff ff fe 04 03 03 01 f5', ErrorCode.CHECKSUM)
+
+    def test_payload_status(self):
+        # The error code isn't included in the checksum of a status packet
+        pkt = self.parse_payload('ff ff 01 02 04 fc', status_packet=True)
+        self.assertEqual(pkt.error_code(), ErrorCode.OVERHEATING)
+
     def test_cmd_bad_checksum(self):
         self.parse_packet('ff ff fe 04 03 03 01 f5', ErrorCode.CHECKSUM)
 
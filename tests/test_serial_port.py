@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+# This file tests the SerialPort class against a fake pyserial port
+
+"""This module implements a fake serial.Serial class which is used for
+   testing the SerialPort class.
+"""
+
+import unittest
+from unittest import mock
+
+from bioloid.bus import Bus
+from bioloid.serial_port import SerialPort
+
+
+def make_packet_bytes(pkt_str):
+    return bytes.fromhex(pkt_str)
+
+
+class FakeSerial:
+    """Implements enough of serial.Serial for testing SerialPort.
+
+       Received data is queued as a list of chunks. Each call to read
+       returns at most one chunk, which simulates pyserial returning
+       fewer bytes than were requested.
+    """
+
+    def __init__(self, **kwargs):
+        """Constructor
+        """
+        self.kwargs = kwargs
+        self.timeout = kwargs.get('timeout')
+        self.chunks = []
+        self.writes = []
+        self.events = []
+        self.responses = []
+
+    @property
+    def in_waiting(self):
+        """Returns the number of bytes in the first queued chunk.
+        """
+        if self.chunks:
+            return len(self.chunks[0])
+        return 0
+
+    def queue(self, *chunks):
+        """Queues up chunks of data to be received.
+        """
+        self.chunks.extend(bytes(chunk) for chunk in chunks)
+
+    def read(self, size=1):
+        """Returns up to size bytes from the first queued chunk, or b''
+           (i.e. a timeout) if nothing is queued.
+        """
+        self.events.append('read')
+        if not self.chunks:
+            return b''
+        chunk = self.chunks[0]
+        data = chunk[:size]
+        if len(chunk) > size:
+            self.chunks[0] = chunk[size:]
+        else:
+            self.chunks.pop(0)
+        return data
+
+    def readinto(self, buf):
+        """Reads up to len(buf) bytes into buf.
+        """
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def reset_input_buffer(self):
+        """Discards any queued data.
+        """
+        self.events.append('reset_input_buffer')
+        self.chunks = []
+
+    def write(self, data):
+        """Records the data written.
+        """
+        self.events.append('write')
+        self.writes.append(bytes(data))
+
+    def flush(self):
+        """Records that the output was flushed, and queues up the next
+           response, as if a device had replied to the packet.
+        """
+        self.events.append('flush')
+        if self.responses:
+            self.queue(self.responses.pop(0))
+
+
+class TestSerialPort(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('serial.Serial', FakeSerial)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_timeouts(self):
+        port = SerialPort('port')
+        self.assertEqual(0.005, port.serial_port.kwargs['timeout'])
+        self.assertIsNone(port.serial_port.kwargs['inter_byte_timeout'])
+        port = SerialPort('port', timeout=0.01, inter_byte_timeout=0.1)
+        self.assertEqual(0.01, port.serial_port.kwargs['timeout'])
+        self.assertEqual(0.1, port.serial_port.kwargs['inter_byte_timeout'])
+
+    def test_ping_timeout_default(self):
+        port = SerialPort('port')
+        self.assertEqual(SerialPort.PING_TIMEOUT_MIN, port.ping_timeout)
+        # The ping timeout scales with the time to receive a status packet
+        port = SerialPort('port', baud=9600, timeout=0.1)
+        self.assertAlmostEqual(0.001 + 120 / 9600, port.ping_timeout)
+        # but is never longer than the regular timeout
+        port = SerialPort('port', timeout=0.001)
+        self.assertEqual(0.001, port.ping_timeout)
+        port = SerialPort('port', ping_timeout=0.01)
+        self.assertEqual(0.01, port.ping_timeout)
+        # A blocking port still gets a ping timeout
+        port = SerialPort('port', timeout=None)
+        self.assertEqual(SerialPort.PING_TIMEOUT_MIN, port.ping_timeout)
+
+    def test_use_ping_timeout(self):
+        port = SerialPort('port', timeout=0.005, ping_timeout=0.003)
+        self.assertEqual(0.005, port.serial_port.timeout)
+        port.use_ping_timeout(True)
+        self.assertEqual(0.003, port.serial_port.timeout)
+        port.use_ping_timeout(False)
+        self.assertEqual(0.005, port.serial_port.timeout)
+
+    def test_read_byte(self):
+        port = SerialPort('port')
+        fake = port.serial_port
+        fake.queue(b'\x01\x02\x03')
+        self.assertTrue(port.is_byte_available())
+        self.assertEqual(0x01, port.read_byte())
+        # Everything the driver had buffered was read at once
+        self.assertEqual(['read'], fake.events)
+        self.assertTrue(port.is_byte_available())
+        self.assertEqual(0x02, port.read_byte())
+        self.assertEqual(0x03, port.read_byte())
+        self.assertEqual(['read'], fake.events)
+        self.assertFalse(port.is_byte_available())
+        self.assertIsNone(port.read_byte())
+
+    def test_read_into(self):
+        port = SerialPort('port')
+        fake = port.serial_port
+        fake.queue(b'\x01\x02\x03', b'\x04\x05')
+        self.assertEqual(0x01, port.read_byte())
+        buf = bytearray(1)
+        self.assertEqual(1, port.read_into(buf))
+        self.assertEqual(b'\x02', buf)
+        # Leftover bytes are followed by bytes from the driver
+        buf = bytearray(3)
+        self.assertEqual(3, port.read_into(buf))
+        self.assertEqual(b'\x03\x04\x05', buf)
+        # A short read returns the number of bytes read
+        fake.queue(b'\x06')
+        self.assertEqual(1, port.read_into(buf))
+        self.assertEqual(b'\x06', buf[:1])
+
+    def test_read_exact(self):
+        port = SerialPort('port')
+        fake = port.serial_port
+        fake.queue(b'\x01\x02', b'\x03', b'\x04\x05\x06')
+        self.assertEqual(0x01, port.read_byte())
+        # The bytes are gathered from several short reads
+        buf = bytearray(4)
+        self.assertEqual(4, port.read_exact(buf))
+        self.assertEqual(b'\x02\x03\x04\x05', buf)
+        buf = bytearray(4)
+        self.assertEqual(1, port.read_exact(memoryview(buf)[:1]))
+        self.assertEqual(b'\x06', buf[:1])
+
+    def test_read_exact_deadline(self):
+        port = SerialPort('port')
+        fake = port.serial_port
+        fake.queue(b'\x01', b'\x02')
+        buf = bytearray(4)
+        with mock.patch('time.monotonic', side_effect=[0.0, 0.002, 0.006]):
+            self.assertEqual(2, port.read_exact(buf))
+        self.assertEqual(b'\x01\x02', buf[:2])
+        # The first read plus one retry was made before the deadline passed
+        self.assertEqual(['read', 'read'], fake.events)
+        fake.events = []
+        fake.queue(b'\x03', b'\x04')
+        with mock.patch('time.monotonic', side_effect=[1.5]):
+            self.assertEqual(1, port.read_exact(buf, deadline=1.2))
+        self.assertEqual(b'\x03', buf[:1])
+        self.assertEqual(['read'], fake.events)
+
+    def test_read_exact_low_baud(self):
+        # At 38400 baud a 255 byte payload takes about 66 msec to arrive,
+        # which is much longer than the timeout.
+        port = SerialPort('port', baud=38400, timeout=0.005)
+        fake = port.serial_port
+        fake.queue(bytes(85), bytes(85), bytes(85))
+        buf = bytearray(255)
+        with mock.patch('time.monotonic', side_effect=[0.0, 0.03, 0.06]):
+            self.assertEqual(255, port.read_exact(buf))
+
+    def test_deadline(self):
+        port = SerialPort('port', timeout=0.005)
+        with mock.patch('time.monotonic', return_value=1.0):
+            self.assertAlmostEqual(1.005, port.deadline())
+        port = SerialPort('port', timeout=None)
+        self.assertIsNone(port.deadline())
+
+    def test_read_status_packet(self):
+        port = SerialPort('port')
+        fake = port.serial_port
+        bus = Bus(port)
+        # The status packet is preceded by garbage, and arrives in pieces
+        fake.queue(make_packet_bytes('00ff12ffff01'), make_packet_bytes('0300'),
+                   make_packet_bytes('20db'))
+        pkt = bus.read_status_packet()
+        self.assertEqual(1, pkt.dev_id)
+        self.assertEqual(b'\x20', pkt.params())
+
+    def check_stale_input(self, scatter_write):
+        # A stale status packet is waiting, both in the driver and in
+        # the SerialPort's own buffer.
+        port = SerialPort('port', scatter_write=scatter_write)
+        fake = port.serial_port
+        fake.queue(make_packet_bytes('ffff01020004'), make_packet_bytes('ffff01020004'))
+        self.assertEqual(0xff, port.read_byte())
+        fake.responses.append(make_packet_bytes('ffff010200fc'))
+        bus = Bus(port)
+        bus.write(1, 0x1e, [0x00, 0x02])
+        self.assertEqual(b''.join(fake.writes), make_packet_bytes('ffff0105031e0002d6'))
+        # Stale input is discarded before writing, and the output is flushed
+        # after the last piece is written.
+        start = fake.events.index('reset_input_buffer')
+        expected = ['reset_input_buffer'] + ['write'] * (3 if scatter_write else 1) + ['flush']
+        self.assertEqual(fake.events[start:start + len(expected)], expected)
+
+    def test_write_packet_stale_input(self):
+        self.check_stale_input(False)
+
+    def test_write_scatter_stale_input(self):
+        self.check_stale_input(True)
+
+
+if __name__ == '__main__':
+    unittest.main()